@@ -0,0 +1,451 @@
+"""
+回答ベクトルの類似検索索引と、診断結果の保存ファイル
+
+診断結果（60問の回答 / 5軸のスコア）を int8 で保持し、回答が近い回答者を探す。
+件数が少ないうちは全件との距離を計算する（厳密検索）。IVF_MIN_ROWS 件以上になると
+k-means で回答ベクトルを区画（IVF）に分け、問い合わせに近い区画だけを探す。
+Streamlit に依存しないため、app.py のほか CLI やベンチマークからも使える。
+"""
+import csv
+import io
+import math
+import threading
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+# 診断結果の保存ファイル（アプリからの送信分と ingest_archive.py の取り込み分）
+RESULTS_STORE_PATH = Path(__file__).parent / "ingested_results.csv"
+# 保存ファイルで結果を識別する列（CSVのバイト列のSHA-256）
+HASH_COLUMN = "Content_Hash"
+
+# 保存ファイルを一度に読み込むバイト数
+STORE_READ_BLOCK_BYTES = 1 << 24
+
+# 診断の質問数と回答値の範囲（app.py の questions_data / OPTIONS と同じ）
+N_QUESTIONS = 60
+ANSWER_MIN, ANSWER_MAX = -3, 3
+# 診断結果タイプの形式（例: INTJ-A）。各文字が AXIS_ORDER の順に対応する
+RESULT_TYPE_PATTERN = r"[EI][NS][FT][JP]-[AT]"
+RESULT_TYPE_LETTER_POSITIONS = {"Mind": 0, "Energy": 1, "Nature": 2, "Tactics": 3, "Identity": 5}
+
+# 軸スコアの並び順と、左側（pct基準）となる文字
+AXIS_ORDER = ["Mind", "Energy", "Nature", "Tactics", "Identity"]
+AXIS_LEFT_LETTERS = {"Mind": "E", "Energy": "N", "Nature": "F", "Tactics": "J", "Identity": "A"}
+# 検索できるベクトルの種類
+SPACES = ("answers", "axes")
+
+# 距離計算を分割する行数（大量データでもメモリ使用量を一定に保つ）
+SEARCH_CHUNK_ROWS = 65536
+# この件数以上になったら IVF を作る
+IVF_MIN_ROWS = 50000
+# 検索時に調べる区画の数
+IVF_NPROBE = 16
+# k-means の反復回数と、区画あたりの学習用サンプル数
+IVF_KMEANS_ITERATIONS = 10
+IVF_TRAIN_ROWS_PER_LIST = 64
+# 区画の割り当てで一度に作る距離行列の要素数
+IVF_ASSIGN_CHUNK_ELEMENTS = 1 << 24
+
+# 保存ファイルへの追記を直列化する
+store_lock = threading.Lock()
+
+
+def details_to_axis_vector(details):
+    """
+    各軸の結果を「左側の文字の割合(0〜100)」に揃えたベクトルにする
+    """
+    vec = []
+    for axis in AXIS_ORDER:
+        d = details[axis]
+        pct = d["pct"] if d["letter"] == AXIS_LEFT_LETTERS[axis] else 100 - d["pct"]
+        vec.append(pct)
+    return np.array(vec, dtype=np.int8)
+
+
+def new_index(n_questions, ivf_in_background=True):
+    """
+    空の索引を作る
+    回答値は-3〜3、軸スコアは0〜100のため、どちらもint8でそのまま保持できる
+    ivf_in_background: IVF の作り直しを別スレッドで行うか
+    """
+    return {
+        "lock": threading.Lock(),
+        "size": 0,
+        "ids": {},
+        "row_ids": [],
+        "names": [],
+        "types": [],
+        "answers": np.zeros((1024, n_questions), dtype=np.int8),
+        "axes": np.zeros((1024, len(AXIS_ORDER)), dtype=np.int8),
+        "ivf": {space: None for space in SPACES},
+        "ivf_building": False,
+        "ivf_in_background": ivf_in_background,
+        # 保存ファイルの読み込み状況（どこまで読んだか）
+        "store": {"lock": threading.Lock(), "key": None, "offset": 0, "header": None},
+    }
+
+
+def append_rows(index, ids, names, types, answer_vecs, axis_vecs):
+    """
+    複数行をまとめて索引に追加する（登録済みのIDは飛ばす）
+    戻り値: 追加した件数
+    """
+    answer_vecs = np.asarray(answer_vecs, dtype=np.int8).reshape(len(ids), -1)
+    axis_vecs = np.asarray(axis_vecs, dtype=np.int8).reshape(len(ids), -1)
+
+    with index["lock"]:
+        seen = index["ids"]
+        keep = []
+        batch = set()
+        for i, row_id in enumerate(ids):
+            if row_id not in seen and row_id not in batch:
+                keep.append(i)
+                batch.add(row_id)
+        if not keep:
+            return 0
+
+        size = index["size"]
+        n = len(keep)
+        # 容量が足りなければ倍に拡張する
+        capacity = len(index["answers"])
+        if size + n > capacity:
+            while size + n > capacity:
+                capacity *= 2
+            for space in SPACES:
+                grown = np.zeros((capacity, index[space].shape[1]), dtype=np.int8)
+                grown[:size] = index[space][:size]
+                index[space] = grown
+
+        keep = np.array(keep)
+        index["answers"][size:size + n] = answer_vecs[keep]
+        index["axes"][size:size + n] = axis_vecs[keep]
+        for j, i in enumerate(keep):
+            seen[ids[i]] = size + j
+            index["row_ids"].append(ids[i])
+            index["names"].append(names[i])
+            index["types"].append(types[i])
+        index["size"] = size + n
+
+        # IVF がある場合は、新しい行を最寄りの区画に割り当てる
+        for space in SPACES:
+            if index["ivf"][space] is not None:
+                assign_new_rows(index["ivf"][space], index[space], size, size + n)
+
+        rebuild = needs_ivf_rebuild(index)
+        if rebuild:
+            index["ivf_building"] = True
+
+    if rebuild:
+        if index["ivf_in_background"]:
+            threading.Thread(target=rebuild_ivf, args=(index,), daemon=True).start()
+        else:
+            rebuild_ivf(index)
+    return n
+
+
+def needs_ivf_rebuild(index):
+    # 件数が IVF_MIN_ROWS に達したとき、または前回の作成時から倍になったときに作り直す
+    if index["ivf_building"] or index["size"] < IVF_MIN_ROWS:
+        return False
+    ivf = index["ivf"]["answers"]
+    return ivf is None or index["size"] >= 2 * ivf["trained_size"]
+
+
+def nearest_centroids(centroids, vectors):
+    """
+    各ベクトルに最も近い区画の番号を返す
+    """
+    centroid_norms = (centroids * centroids).sum(axis=1)
+    chunk = max(1, IVF_ASSIGN_CHUNK_ELEMENTS // len(centroids))
+    result = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), chunk):
+        block = vectors[start:start + chunk].astype(np.float32)
+        # |v - c|^2 = |v|^2 - 2v・c + |c|^2（|v|^2 は比較に影響しない）
+        dist = centroid_norms - 2 * (block @ centroids.T)
+        result[start:start + chunk] = dist.argmin(axis=1)
+    return result
+
+
+def build_ivf(vectors, seed=0):
+    """
+    k-means で区画を作り、各行を区画ごとに並べた IVF を返す
+    """
+    n, dim = vectors.shape
+    nlist = max(1, int(round(math.sqrt(n))))
+    rng = np.random.default_rng(seed)
+
+    # 学習はサンプルで行う
+    sample_size = min(n, nlist * IVF_TRAIN_ROWS_PER_LIST)
+    sample = vectors[rng.choice(n, sample_size, replace=False)].astype(np.float32)
+    centroids = sample[rng.choice(sample_size, nlist, replace=False)].copy()
+    for _ in range(IVF_KMEANS_ITERATIONS):
+        labels = nearest_centroids(centroids, sample)
+        counts = np.bincount(labels, minlength=nlist)
+        sums = np.zeros((nlist, dim), dtype=np.float32)
+        np.add.at(sums, labels, sample)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # 空になった区画はランダムなサンプルで置き直す
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = sample[rng.choice(sample_size, len(empty), replace=False)]
+
+    assign = nearest_centroids(centroids, vectors)
+    counts = np.bincount(assign, minlength=nlist)
+    return {
+        "centroids": centroids,
+        "trained_size": n,
+        # 区画ごとに並べた行番号と、各区画の開始位置
+        "order": np.argsort(assign, kind="stable"),
+        "offsets": np.concatenate([[0], np.cumsum(counts)]),
+        # 全行の区画番号（作成後に追加された行もここに割り当てる）
+        "assign": assign,
+    }
+
+
+def assign_new_rows(ivf, vectors, start, end):
+    # IVF 作成後に追加された行を区画に割り当てる（呼び出し側でロックを取ること）
+    if len(ivf["assign"]) < end:
+        grown = np.zeros(max(end, 2 * len(ivf["assign"])), dtype=np.int32)
+        grown[:len(ivf["assign"])] = ivf["assign"]
+        ivf["assign"] = grown
+    ivf["assign"][start:end] = nearest_centroids(ivf["centroids"], vectors[start:end])
+
+
+def rebuild_ivf(index):
+    """
+    現在の全行から IVF を作り直す
+    作成中に追加された行は、作成後に割り当ててから差し替える
+    """
+    try:
+        with index["lock"]:
+            index["ivf_building"] = True
+            size = index["size"]
+            snapshot = {space: index[space] for space in SPACES}
+        # 既存の行は書き換えられないため、ロックの外で計算できる
+        built = {space: build_ivf(snapshot[space][:size]) for space in SPACES}
+        with index["lock"]:
+            for space in SPACES:
+                assign_new_rows(built[space], index[space], size, index["size"])
+                index["ivf"][space] = built[space]
+    finally:
+        with index["lock"]:
+            index["ivf_building"] = False
+
+
+def squared_distances(vectors, query_vec, rows=None):
+    """
+    問い合わせとの二乗距離を分割して計算する
+    rows を指定した場合はその行だけを計算する
+    """
+    n = len(vectors) if rows is None else len(rows)
+    dist = np.empty(n, dtype=np.int64)
+    for start in range(0, n, SEARCH_CHUNK_ROWS):
+        if rows is None:
+            block = vectors[start:start + SEARCH_CHUNK_ROWS]
+        else:
+            block = vectors[rows[start:start + SEARCH_CHUNK_ROWS]]
+        diff = block.astype(np.int32) - query_vec
+        dist[start:start + SEARCH_CHUNK_ROWS] = np.einsum("ij,ij->i", diff, diff)
+    return dist
+
+
+def search(index, query_vec, k=5, space="answers", exclude_id=None, nprobe=IVF_NPROBE, exact=False):
+    """
+    回答が近い回答者を探す（ユークリッド距離の近い順）
+    space: "answers"（60問の回答）または "axes"（5軸のスコア）
+    IVF がある場合は nprobe 個の区画だけを探す。exact=True なら常に全件を探す
+    戻り値: [{"id", "name", "result_type", "distance"}, ...]
+    """
+    if space not in SPACES:
+        raise ValueError(f"space must be 'answers' or 'axes': {space}")
+    query_vec = np.asarray(query_vec, dtype=np.int32)
+
+    with index["lock"]:
+        size = index["size"]
+        vectors = index[space]
+        row_ids = index["row_ids"]
+        names = index["names"]
+        types = index["types"]
+        excluded = index["ids"].get(exclude_id)
+        ivf = None if exact else index["ivf"][space]
+        assign = ivf["assign"] if ivf is not None else None
+    if size == 0 or k <= 0:
+        return []
+
+    if ivf is None:
+        rows = np.arange(size)
+        dist = squared_distances(vectors[:size], query_vec)
+    else:
+        # 問い合わせに近い区画の行と、作成後に追加された行のうち同じ区画のものを候補にする
+        centroid_dist = ((ivf["centroids"] - query_vec) ** 2).sum(axis=1)
+        nprobe = min(nprobe, len(centroid_dist))
+        probes = np.argpartition(centroid_dist, nprobe - 1)[:nprobe]
+        order, offsets = ivf["order"], ivf["offsets"]
+        trained = ivf["trained_size"]
+        tail = np.arange(trained, size)
+        rows = np.concatenate(
+            [order[offsets[p]:offsets[p + 1]] for p in probes]
+            + [tail[np.isin(assign[trained:size], probes)]]
+        )
+        dist = squared_distances(vectors, query_vec, rows)
+
+    if excluded is not None:
+        mask = rows != excluded
+        rows, dist = rows[mask], dist[mask]
+
+    # 上位k件だけ部分ソート
+    k = min(k, len(rows))
+    if k <= 0:
+        return []
+    top = np.argpartition(dist, k - 1)[:k]
+    top = top[np.argsort(dist[top], kind="stable")]
+    return [
+        {
+            "id": row_ids[rows[i]],
+            "name": names[rows[i]],
+            "result_type": types[rows[i]],
+            "distance": float(math.sqrt(dist[i])),
+        }
+        for i in top
+    ]
+
+
+def valid_result_rows(df, n_questions=N_QUESTIONS):
+    """
+    診断結果CSVの行が正しい形式かを判定する
+    回答値が-3〜3の整数、各軸の pct が0〜100の整数、タイプが INTJ-A 形式の行だけ True
+    """
+    answer_columns = [f"Q{i+1}" for i in range(n_questions)]
+    pct_columns = [f"{axis}_Pct" for axis in AXIS_ORDER]
+    if any(c not in df.columns for c in ["Result_Type"] + answer_columns + pct_columns):
+        return np.zeros(len(df), dtype=bool)
+
+    def integers_in_range(columns, low, high):
+        values = np.column_stack(
+            [pd.to_numeric(df[c], errors="coerce").to_numpy(dtype=np.float64) for c in columns]
+        )
+        # NaN や inf は比較で False になる
+        return ((values >= low) & (values <= high) & (values == np.round(values))).all(axis=1)
+
+    result_types = df["Result_Type"].astype(str)
+    return (
+        integers_in_range(answer_columns, ANSWER_MIN, ANSWER_MAX)
+        & integers_in_range(pct_columns, 0, 100)
+        & result_types.str.fullmatch(RESULT_TYPE_PATTERN).to_numpy(dtype=bool)
+    )
+
+
+def append_results_frame(index, df):
+    """
+    保存ファイル形式の DataFrame を検証し、正しい行だけを索引に追加する
+    戻り値: 追加した件数
+    """
+    n_questions = index["answers"].shape[1]
+    if HASH_COLUMN not in df.columns:
+        return 0
+    valid = valid_result_rows(df, n_questions) & df[HASH_COLUMN].notna().to_numpy()
+    df = df[valid]
+    if df.empty:
+        return 0
+
+    answer_vecs = df[[f"Q{i+1}" for i in range(n_questions)]].astype(np.float64).to_numpy().astype(np.int8)
+    result_types = df["Result_Type"].astype(str)
+    axis_vecs = np.empty((len(df), len(AXIS_ORDER)), dtype=np.int8)
+    for j, axis in enumerate(AXIS_ORDER):
+        pct = df[f"{axis}_Pct"].astype(np.float64).to_numpy().astype(np.int16)
+        letter = result_types.str[RESULT_TYPE_LETTER_POSITIONS[axis]].to_numpy()
+        # 「左側の文字の割合」に揃える（details_to_axis_vector と同じ）
+        axis_vecs[:, j] = np.where(letter == AXIS_LEFT_LETTERS[axis], pct, 100 - pct)
+
+    names = df["User_Name"].fillna("").astype(str).tolist() if "User_Name" in df.columns else [""] * len(df)
+    return append_rows(
+        index, df[HASH_COLUMN].astype(str).tolist(), names, result_types.tolist(), answer_vecs, axis_vecs
+    )
+
+
+def load_results_csv(index, path=RESULTS_STORE_PATH):
+    """
+    保存ファイルのうち、まだ読み込んでいない部分を索引に追加する
+    ファイルが更新されていなければ何もしない。別の読み込みが実行中の場合も何もしない
+    戻り値: 追加した件数
+    """
+    path = Path(path)
+    state = index["store"]
+    if not state["lock"].acquire(blocking=False):
+        return 0
+    try:
+        try:
+            stat = path.stat()
+        except FileNotFoundError:
+            return 0
+        key = (stat.st_mtime_ns, stat.st_size)
+        if key == state["key"]:
+            return 0
+        if stat.st_size < state["offset"]:
+            # ファイルが作り直された場合は最初から読む（登録済みのIDは飛ばされる）
+            state["offset"], state["header"] = 0, None
+
+        added = 0
+        with open(path, "rb") as f:
+            if state["header"] is None:
+                line = f.readline()
+                if not line.endswith(b"\n"):
+                    return 0
+                state["header"] = next(csv.reader([line.decode("utf-8-sig")]))
+                state["offset"] = f.tell()
+            # 回答と pct の列は数値として読み、それ以外は文字列のまま読む
+            text_columns = {
+                c: str for c in state["header"]
+                if not ((c.startswith("Q") and c[1:].isdigit()) or c.endswith("_Pct"))
+            }
+            # 行の途中で切れないよう、最後の改行までをブロック単位で読む
+            f.seek(state["offset"])
+            while True:
+                block = f.read(STORE_READ_BLOCK_BYTES)
+                end = block.rfind(b"\n")
+                if end < 0:
+                    break
+                block = block[:end + 1]
+                df = pd.read_csv(
+                    io.BytesIO(block), names=state["header"], header=None, dtype=text_columns,
+                    encoding="utf-8", on_bad_lines="skip"
+                )
+                added += append_results_frame(index, df)
+                state["offset"] += len(block)
+                f.seek(state["offset"])
+        state["key"] = key
+        return added
+    finally:
+        state["lock"].release()
+
+
+def load_results_csv_in_background(index, path=RESULTS_STORE_PATH):
+    """
+    保存ファイルが更新されていれば、別スレッドで読み込む
+    """
+    path = Path(path)
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return
+    if (stat.st_mtime_ns, stat.st_size) != index["store"]["key"]:
+        threading.Thread(target=load_results_csv, args=(index, path), daemon=True).start()
+
+
+def append_results_csv(content_hash, result_df, path=RESULTS_STORE_PATH):
+    """
+    診断結果CSVの行を保存ファイルに追記する
+    列は既存ファイルの見出しに揃える
+    """
+    path = Path(path)
+    row = result_df.copy()
+    row.insert(0, HASH_COLUMN, content_hash)
+    with store_lock:
+        if path.exists() and path.stat().st_size > 0:
+            header = pd.read_csv(path, encoding="utf-8-sig", nrows=0).columns
+            row.reindex(columns=header).to_csv(path, mode="a", header=False, index=False, encoding="utf-8")
+        else:
+            row.to_csv(path, index=False, encoding="utf-8-sig")
@@ -2,15 +2,21 @@ import streamlit as st
 import pandas as pd
 import json
 import datetime
+import hashlib
 import math
 import os
 import smtplib
+import threading
+import time
+from collections import OrderedDict
 from email.mime.text import MIMEText
 from email.mime.multipart import MIMEMultipart
 from email.mime.base import MIMEBase
 from email import encoders
 from pathlib import Path
 
+import answer_index
+
 # ==========================================
 # 0. 設定とCSSスタイル定義
 # ==========================================
@@ -445,6 +451,106 @@ def send_result_email(to_email, result_type, details, gender, user_name, csv_dat
     except Exception as e:
         return False, f"エラーが発生しました: {str(e)}"
 
+# ==========================================
+# 重複送信の防止
+# ==========================================
+# 同一回答とみなす時間幅（秒）
+SUBMISSION_TIME_BUCKET_SECONDS = 600
+# 送信済みIDの保持件数と保持期間（秒）
+SENT_SUBMISSIONS_MAX = 1024
+SENT_SUBMISSIONS_TTL_SECONDS = 3600
+
+def make_submission_id(answers, user_name, finished_at):
+    """
+    回答内容・回答者名・時間帯から送信IDを作る
+    同じ内容を短時間に再送しても同じIDになる
+    """
+    bucket = int(finished_at // SUBMISSION_TIME_BUCKET_SECONDS)
+    answer_text = ",".join(str(answers.get(q["id"], 0)) for q in questions_data)
+    payload = f"{user_name}\n{answer_text}\n{bucket}"
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+@st.cache_resource
+def get_sent_submissions():
+    # 全セッション共通の送信ID（LRU + TTL）
+    # 値は {"status": "sending" または "sent", "time": 登録時刻}
+    return {"lock": threading.Lock(), "ids": OrderedDict()}
+
+def send_result_email_once(submission_id, to_email, result_type, details, gender, user_name, csv_data):
+    """
+    同じ送信IDのメールは1回だけ送信する
+    再実行やボタンの連打による重複送信を防ぐ
+    戻り値の success は True（送信済み）/ False（失敗）/ None（別の送信が処理中）
+    """
+    sent = get_sent_submissions()
+    now = time.time()
+    with sent["lock"]:
+        ids = sent["ids"]
+        # 期限切れのIDを削除（古い順に並んでいる）
+        while ids and now - next(iter(ids.values()))["time"] > SENT_SUBMISSIONS_TTL_SECONDS:
+            ids.popitem(last=False)
+        entry = ids.get(submission_id)
+        if entry is not None and entry["status"] == "sent":
+            return True, "この診断結果は送信済みです"
+        if entry is not None:
+            return None, "この診断結果は送信中です。しばらくしてから結果を確認してください"
+        # 送信中も登録しておき、同時の二重送信を防ぐ
+        ids[submission_id] = {"status": "sending", "time": now}
+        while len(ids) > SENT_SUBMISSIONS_MAX:
+            ids.popitem(last=False)
+
+    success, message = send_result_email(to_email, result_type, details, gender, user_name, csv_data)
+    with sent["lock"]:
+        if success:
+            # 送信が完了したIDだけを送信済みとして扱う
+            sent["ids"][submission_id] = {"status": "sent", "time": time.time()}
+            sent["ids"].move_to_end(submission_id)
+        else:
+            # 失敗した場合は再送できるようにIDを外す
+            sent["ids"].pop(submission_id, None)
+    return success, message
+
+# ==========================================
+# 類似回答者検索
+# ==========================================
+# 回答ベクトル同士の最大距離（類似度の表示に使う）
+MAX_ANSWER_DISTANCE = math.sqrt(len(questions_data) * (max(OPTIONS) - min(OPTIONS)) ** 2)
+
+@st.cache_resource
+def get_answer_index():
+    # 全セッション共通の回答ベクトル索引
+    # 保存ファイルは別スレッドで読み込むため、読み込み中も画面の表示や送信は止まらない
+    index = answer_index.new_index(len(questions_data))
+    answer_index.load_results_csv_in_background(index)
+    return index
+
+def refresh_answer_index():
+    # 保存ファイルが更新されていれば（ingest_archive.py の取り込みなど）追加分を読み込む
+    answer_index.load_results_csv_in_background(get_answer_index())
+
+def save_result(content_hash, user_name, result_type, answers, details, result_df):
+    """
+    送信した診断結果を索引に追加し、保存ファイルにも追記する
+    再起動後も保存ファイルから索引を作り直せる
+    """
+    answer_vec = [answers.get(q["id"], 0) for q in questions_data]
+    axis_vec = answer_index.details_to_axis_vector(details)
+    added = answer_index.append_rows(
+        get_answer_index(), [content_hash], [user_name], [result_type], [answer_vec], [axis_vec]
+    )
+    # 索引に追加できた（未登録だった）ときだけ追記する
+    if added:
+        answer_index.append_results_csv(content_hash, result_df)
+    return bool(added)
+
+def find_similar_respondents(answers, k=5, exclude_id=None):
+    """
+    回答が近い過去の回答者を探す（ユークリッド距離の近い順）
+    戻り値: [{"id", "name", "result_type", "distance"}, ...]
+    """
+    query_vec = [answers.get(q["id"], 0) for q in questions_data]
+    return answer_index.search(get_answer_index(), query_vec, k=k, exclude_id=exclude_id)
+
 # --- 16タイプ分類（名称のみ） ---
 def get_type_info(result_type):
     base_type = result_type.split("-")[0]
@@ -590,21 +696,41 @@ def render_result():
         csv_data[f"Q{qid+1}"] = [val]
     df = pd.DataFrame(csv_data)
     csv = df.to_csv(index=False).encode('utf-8-sig')
+    # 添付CSVのハッシュ（ingest_archive.py の取り込み済み判定と同じ値）
+    content_hash = hashlib.sha256(csv).hexdigest()
     
     if st.button("📧 診断結果をメールで送信", type="primary", use_container_width=True):
         if not user_name:
             st.error("お名前を入力してください。")
         else:
             with st.spinner("送信中..."):
-                success, message = send_result_email(recipient_email, result_type, details, gender, user_name, csv)
+                submission_id = make_submission_id(
+                    st.session_state.answers,
+                    user_name,
+                    st.session_state.get("finished_at", time.time())
+                )
+                success, message = send_result_email_once(submission_id, recipient_email, result_type, details, gender, user_name, csv)
                 if success:
+                    save_result(content_hash, user_name, result_type, st.session_state.answers, details, df)
                     st.success(message)
+                elif success is None:
+                    st.warning(message)
                 else:
                     st.error(message)
 
     st.markdown("### 📥 データのダウンロード")
     safe_name = user_name.replace(' ', '_') if user_name else 'user'
     st.download_button("診断結果CSVをダウンロード", data=csv, file_name=f'personality_{safe_name}_{result_type}.csv', mime='text/csv')
+
+    # 類似回答者（他の回答者の名前は表示しない）
+    refresh_answer_index()
+    similar = find_similar_respondents(st.session_state.answers, k=3, exclude_id=content_hash)
+    if similar:
+        st.markdown("### 🧭 回答傾向が近い過去の回答者")
+        for r in similar:
+            similarity = int(round(100 * (1 - r["distance"] / MAX_ANSWER_DISTANCE)))
+            group = get_type_info(r["result_type"])["group"]
+            st.markdown(f"- {r['result_type']}（{group}） 類似度 {similarity}%")
     
     st.markdown("---")
     
@@ -616,6 +742,9 @@ def render_result():
 
 
 def main():
+    # 索引の読み込みを起動直後に始めておく
+    get_answer_index()
+
     # 完了フラグが立っていたら結果を表示して終了
     if st.session_state.finished:
         render_result()
@@ -715,6 +844,7 @@ def main():
                         val = 0
                     st.session_state.answers[qid] = int(val)
                 st.session_state.finished = True
+                st.session_state.finished_at = time.time()
                 st.rerun()
 
 if __name__ == "__main__":
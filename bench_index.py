@@ -0,0 +1,97 @@
+"""
+類似回答者検索のベンチマーク
+
+合成データで索引を作り、厳密検索と IVF（nprobe ごと）の
+1問い合わせあたりの検索時間と recall@k を表示する。
+
+使い方:
+    python bench_index.py
+    python bench_index.py --rows 100000 --nprobe 1,4,8,16 --space axes
+"""
+import argparse
+import time
+
+import numpy as np
+
+import answer_index
+
+N_QUESTIONS = answer_index.N_QUESTIONS
+
+
+def make_vectors(rng, centers, n, space):
+    """
+    回答の傾向（中心）ごとにばらつきを加えた合成データを作る
+    """
+    labels = rng.integers(0, len(centers), n)
+    if space == "answers":
+        noise = rng.normal(0, 1.2, (n, N_QUESTIONS))
+        return np.clip(np.rint(centers[labels] + noise), -3, 3).astype(np.int8)
+    noise = rng.normal(0, 8, (n, len(answer_index.AXIS_ORDER)))
+    return np.clip(np.rint(centers[labels] + noise), 0, 100).astype(np.int8)
+
+
+def timed_search(index, queries, k, space, **kwargs):
+    results, latencies = [], []
+    for q in queries:
+        started = time.perf_counter()
+        results.append(answer_index.search(index, q, k=k, space=space, **kwargs))
+        latencies.append(time.perf_counter() - started)
+    return results, np.array(latencies) * 1000
+
+
+def recall_at_k(results, truth, k):
+    # 同距離の行があるため、厳密検索のk番目の距離以下の結果を正解として数える
+    hits = 0
+    for got, exact in zip(results, truth):
+        kth = exact[-1]["distance"]
+        hits += sum(1 for r in got if r["distance"] <= kth + 1e-9)
+    return hits / (k * len(truth))
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="類似回答者検索のベンチマーク")
+    parser.add_argument("--rows", type=int, default=1_000_000, help="索引の件数")
+    parser.add_argument("--queries", type=int, default=200, help="問い合わせの件数")
+    parser.add_argument("-k", type=int, default=10, help="取得する件数")
+    parser.add_argument("--nprobe", default="1,4,8,16,32", help="試す nprobe（カンマ区切り）")
+    parser.add_argument("--space", choices=answer_index.SPACES, default="answers", help="比較するベクトル")
+    parser.add_argument("--clusters", type=int, default=64, help="合成データの傾向の数")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    rng = np.random.default_rng(args.seed)
+    if args.space == "answers":
+        centers = rng.integers(-3, 4, (args.clusters, N_QUESTIONS)).astype(np.float32)
+    else:
+        centers = rng.integers(0, 101, (args.clusters, len(answer_index.AXIS_ORDER))).astype(np.float32)
+    vectors = make_vectors(rng, centers, args.rows, args.space)
+    queries = make_vectors(rng, centers, args.queries, args.space)
+
+    # 使わない方のベクトルは0で埋める
+    answers = vectors if args.space == "answers" else np.zeros((args.rows, N_QUESTIONS), dtype=np.int8)
+    axes = vectors if args.space == "axes" else np.zeros((args.rows, len(answer_index.AXIS_ORDER)), dtype=np.int8)
+    ids = [str(i) for i in range(args.rows)]
+    types = ["INTJ-A"] * args.rows
+
+    index = answer_index.new_index(N_QUESTIONS, ivf_in_background=False)
+    started = time.perf_counter()
+    answer_index.append_rows(index, ids, ids, types, answers, axes)
+    if index["ivf"][args.space] is None:
+        answer_index.rebuild_ivf(index)
+    ivf = index["ivf"][args.space]
+    print(f"rows={args.rows} space={args.space} k={args.k} queries={args.queries}")
+    print(f"build: {time.perf_counter() - started:.1f}s (nlist={len(ivf['centroids'])})")
+
+    truth, latencies = timed_search(index, queries, args.k, args.space, exact=True)
+    print(f"{'method':<14}{'recall@k':>10}{'mean ms':>10}{'p50 ms':>10}{'p95 ms':>10}")
+    print(f"{'exact':<14}{1.0:>10.3f}{latencies.mean():>10.2f}"
+          f"{np.percentile(latencies, 50):>10.2f}{np.percentile(latencies, 95):>10.2f}")
+    for nprobe in [int(x) for x in args.nprobe.split(",")]:
+        results, latencies = timed_search(index, queries, args.k, args.space, nprobe=nprobe)
+        recall = recall_at_k(results, truth, args.k)
+        print(f"{'ivf nprobe=' + str(nprobe):<14}{recall:>10.3f}{latencies.mean():>10.2f}"
+              f"{np.percentile(latencies, 50):>10.2f}{np.percentile(latencies, 95):>10.2f}")
+
+
+if __name__ == "__main__":
+    main()
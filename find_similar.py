@@ -0,0 +1,84 @@
+"""
+回答傾向が近い過去の回答者を探すツール（チーム編成用）
+
+保存ファイル（ingested_results.csv）の診断結果から、指定した回答者に近い回答者を表示する。
+アプリの結果画面では他の回答者の名前を出さないが、このツールは管理者向けのため名前も表示する。
+
+使い方:
+    python find_similar.py personality_本田宗一郎_INTJ-A.csv
+    python find_similar.py --name 本田宗一郎 -k 10 --space axes
+"""
+import argparse
+import hashlib
+import sys
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+import answer_index
+
+N_QUESTIONS = answer_index.N_QUESTIONS
+
+
+def read_query_csv(path):
+    """
+    診断結果CSV（ダウンロードまたはメール添付）から問い合わせベクトルを作る
+    戻り値: (コンテンツハッシュ, 回答ベクトル, 軸ベクトル)
+    """
+    data = Path(path).read_bytes()
+    df = pd.read_csv(path, encoding="utf-8-sig")
+    if df.empty or not answer_index.valid_result_rows(df, N_QUESTIONS)[0]:
+        raise ValueError(f"診断結果CSVの形式ではありません: {path}")
+    row = df.iloc[0]
+    result_type = row["Result_Type"]
+    letters = result_type.split("-")[0] + result_type.split("-")[1]
+    details = {
+        axis: {"letter": letters[i], "pct": int(row[f"{axis}_Pct"])}
+        for i, axis in enumerate(answer_index.AXIS_ORDER)
+    }
+    answer_vec = np.array([int(row[f"Q{i+1}"]) for i in range(N_QUESTIONS)], dtype=np.int8)
+    return hashlib.sha256(data).hexdigest(), answer_vec, answer_index.details_to_axis_vector(details)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="回答傾向が近い過去の回答者を探す")
+    parser.add_argument("csv", nargs="?", help="問い合わせに使う診断結果CSV")
+    parser.add_argument("--name", help="保存ファイル内の回答者名で問い合わせる")
+    parser.add_argument("-k", type=int, default=5, help="表示する件数")
+    parser.add_argument("--space", choices=answer_index.SPACES, default="answers", help="比較するベクトル")
+    parser.add_argument("--store", default=str(answer_index.RESULTS_STORE_PATH), help="保存ファイル")
+    parser.add_argument("--exact", action="store_true", help="IVF を使わず全件を検索する")
+    args = parser.parse_args(argv)
+
+    if not args.csv and not args.name:
+        parser.error("診断結果CSVか --name を指定してください")
+
+    index = answer_index.new_index(N_QUESTIONS, ivf_in_background=False)
+    answer_index.load_results_csv(index, args.store)
+
+    if args.name:
+        rows = [i for i, name in enumerate(index["names"]) if name == args.name]
+        if not rows:
+            print(f"見つかりません: {args.name}", file=sys.stderr)
+            return 1
+        # 同名の回答者が複数いる場合は最新の結果を使う
+        row = rows[-1]
+        exclude_id = index["row_ids"][row]
+        query_vec = index[args.space][row]
+    else:
+        try:
+            exclude_id, answer_vec, axis_vec = read_query_csv(args.csv)
+        except (OSError, ValueError) as e:
+            print(e, file=sys.stderr)
+            return 1
+        query_vec = answer_vec if args.space == "answers" else axis_vec
+
+    results = answer_index.search(index, query_vec, k=args.k, space=args.space, exclude_id=exclude_id, exact=args.exact)
+    for rank, r in enumerate(results, 1):
+        print(f"{rank}\t{r['name']}\t{r['result_type']}\t{r['distance']:.2f}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,166 @@
+"""
+過去の診断結果メールから結果データを取り込むツール
+
+send_result_email が送信したメール（mbox または .eml ファイルのディレクトリ）を
+読み込み、添付の personality_*.csv を取り出して ingested_results.csv に追記する。
+取り込み済みの添付はコンテンツハッシュで判定してスキップする。
+
+使い方:
+    python ingest_archive.py archive.mbox
+    python ingest_archive.py mails/ --workers 8
+"""
+import argparse
+import csv
+import hashlib
+import io
+import mailbox
+import os
+import sys
+import time
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from email import message_from_bytes
+from email import policy
+from pathlib import Path
+
+import pandas as pd
+
+from answer_index import HASH_COLUMN, RESULTS_STORE_PATH, valid_result_rows
+
+# 取り込み先（app.py の類似回答者検索が起動時に読み込む）
+DEFAULT_OUTPUT_PATH = RESULTS_STORE_PATH
+# 処理待ちにしておくメール数（ワーカー数あたり）
+IN_FLIGHT_PER_WORKER = 16
+
+
+def iter_raw_messages(source):
+    """
+    mbox ファイルまたは .eml ディレクトリからメールを1通ずつ bytes で返す
+    """
+    source = Path(source)
+    if source.is_dir():
+        with os.scandir(source) as entries:
+            for entry in entries:
+                if entry.is_file() and entry.name.lower().endswith(".eml"):
+                    with open(entry.path, "rb") as f:
+                        yield f.read()
+    else:
+        box = mailbox.mbox(str(source), create=False)
+        try:
+            for key in box.iterkeys():
+                yield box.get_bytes(key)
+        finally:
+            box.close()
+
+
+def extract_result_rows(raw_message):
+    """
+    メール1通から診断結果CSVの行を取り出す（ワーカープロセスで実行）
+    戻り値: [(コンテンツハッシュ, 行のdict), ...]
+    """
+    try:
+        msg = message_from_bytes(raw_message, policy=policy.default)
+    except Exception:
+        return []
+
+    rows = []
+    for part in msg.iter_attachments():
+        # RFC 2231 形式のファイル名は get_filename でデコードされる
+        filename = part.get_filename() or ""
+        if not (filename.startswith("personality_") and filename.endswith(".csv")):
+            continue
+        data = part.get_payload(decode=True)
+        if not data:
+            continue
+        content_hash = hashlib.sha256(data).hexdigest()
+        try:
+            text = data.decode("utf-8-sig")
+        except UnicodeDecodeError:
+            continue
+        attachment_rows = list(csv.DictReader(io.StringIO(text)))
+        if not attachment_rows:
+            continue
+        # 診断結果の形式に合わない行（範囲外の値など）は取り込まない
+        valid = valid_result_rows(pd.DataFrame(attachment_rows))
+        rows.extend((content_hash, row) for row, ok in zip(attachment_rows, valid) if ok)
+    return rows
+
+
+def load_ingested_hashes(output_path):
+    """
+    取り込み済みのコンテンツハッシュと既存の列名を読み込む
+    """
+    hashes = set()
+    fieldnames = None
+    if output_path.exists():
+        with open(output_path, encoding="utf-8-sig", newline="") as f:
+            reader = csv.DictReader(f)
+            fieldnames = reader.fieldnames
+            for row in reader:
+                hashes.add(row.get(HASH_COLUMN))
+    return hashes, fieldnames
+
+
+def ingest(source, output_path=DEFAULT_OUTPUT_PATH, workers=None):
+    """
+    メールアーカイブを取り込み、(読み込んだメール数, 追加した行数) を返す
+    """
+    output_path = Path(output_path)
+    seen, fieldnames = load_ingested_hashes(output_path)
+    workers = workers or os.cpu_count() or 1
+    max_in_flight = workers * IN_FLIGHT_PER_WORKER
+
+    message_count = 0
+    row_count = 0
+    is_new_file = fieldnames is None
+    with open(output_path, "a", encoding="utf-8-sig" if is_new_file else "utf-8", newline="") as out, \
+            ProcessPoolExecutor(max_workers=workers) as pool:
+        writer = None
+        if fieldnames:
+            writer = csv.DictWriter(out, fieldnames=fieldnames, extrasaction="ignore")
+
+        def write_rows(rows):
+            nonlocal writer, row_count
+            for content_hash, row in rows:
+                if content_hash in seen:
+                    continue
+                if writer is None:
+                    writer = csv.DictWriter(out, fieldnames=[HASH_COLUMN] + list(row.keys()), extrasaction="ignore")
+                    writer.writeheader()
+                writer.writerow({HASH_COLUMN: content_hash, **row})
+                row_count += 1
+            # 1通に複数行があっても、まとめて取り込み済みにする
+            seen.update(content_hash for content_hash, _ in rows)
+
+        # 処理待ちの数を制限し、メモリ使用量を一定に保つ
+        pending = deque()
+        for raw in iter_raw_messages(source):
+            pending.append(pool.submit(extract_result_rows, raw))
+            message_count += 1
+            if len(pending) >= max_in_flight:
+                write_rows(pending.popleft().result())
+        while pending:
+            write_rows(pending.popleft().result())
+
+    return message_count, row_count
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="診断結果メールのアーカイブから結果データを取り込む")
+    parser.add_argument("source", help="mbox ファイル、または .eml ファイルのディレクトリ")
+    parser.add_argument("-o", "--output", default=str(DEFAULT_OUTPUT_PATH), help="取り込み先のCSVファイル")
+    parser.add_argument("-w", "--workers", type=int, default=None, help="並列プロセス数（既定: CPU数）")
+    args = parser.parse_args(argv)
+
+    if not Path(args.source).exists():
+        print(f"見つかりません: {args.source}", file=sys.stderr)
+        return 1
+
+    started = time.time()
+    message_count, row_count = ingest(args.source, args.output, args.workers)
+    print(f"{message_count}通のメールを読み込み、{row_count}件を追加しました（{time.time() - started:.1f}秒）")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())